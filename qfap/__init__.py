@@ -1,11 +1,12 @@
 import sys
 import logging
 
+from .card import Card
 from .event import Event
 from .filter import Filter
 from .database import Database
 
-__all__ = ['Event', 'Filter', 'Database']
+__all__ = ['Card', 'Event', 'Filter', 'Database']
 
 
 ###########
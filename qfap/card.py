@@ -0,0 +1,66 @@
+from .event import Event
+from .utils import split_category
+
+
+# Bumped whenever the structure below changes, so that existing cards get rebuilt.
+card_version = 1
+
+# Every card should have this structure.
+card_structure = {
+    'id': str,
+    'title': str,
+    'lead_text': str,
+    'snippet': str,  # Precomputed `Event.get_lead_text_snippet()`
+    'cover_url': str,
+    'cover_alt': str,
+    'category': str,  # Raw category, as stored in the dataset. e.g: "Concerts -> Jazz"
+    'main_category': str,  # Split from `category`, used to keep the categories cache up-to-date
+    'sub_category': str,
+    'date_start': int,  # First occurrence (`date_start` of the source document), as a Unix timestamp
+    'updated_at': str,  # Copied from the source document, used to detect changes
+    'version': int,  # `card_version` at the time the card was built
+}
+
+
+def forge_card(event: Event) -> dict:
+    """
+    Takes an event and computes the corresponding card, ready to be stored in the cards collection.
+
+    :param Event event: The event to summarize.
+    :return dict: A card, following `card_structure`, with its `_id` set to the event's ID.
+    """
+    try:
+        main_category, sub_category = split_category(event.category)
+    except ValueError:
+        # The category is missing or malformed, the event is still listed but won't appear in the categories.
+        main_category, sub_category = '', ''
+    return {
+        '_id': event.id,
+        'id': event.id,
+        'title': event.title,
+        'lead_text': event.lead_text,
+        'snippet': event.get_lead_text_snippet(),
+        'cover_url': event.cover_url,
+        'cover_alt': event.cover_alt,
+        'category': event.category,
+        'main_category': main_category,
+        'sub_category': sub_category,
+        'date_start': event.date_start,
+        'updated_at': event.updated_at,
+        'version': card_version,
+    }
+
+
+class Card:
+
+    """
+
+    Denormalized, read-only view of an event.
+    Holds only what is needed to render the event in a list (home, search, similar events),
+    so that we don't have to load and validate the whole document.
+
+    """
+
+    def __init__(self, info: dict):
+        for key, default in card_structure.items():
+            self.__setattr__(key, info.get(key, default()))
@@ -3,18 +3,23 @@ import random
 import shelve
 import pymongo
 import logging
+import threading
 
-from time import time
+from time import time, sleep
 from typing import List, Set
 
 from .event import Event
 from .filter import Filter
+from .card import Card, card_version, forge_card
 
 
 class Database:
 
     srv_env_var: str = 'QFAP_SERVER'
     srv_args: str = '?retryWrites=true&w=majority'
+    cards_suffix: str = '_cards'
+    cards_refresh_interval: int = 300  # In seconds
+    card_projection: dict = {'_id': 0}
 
     def __init__(self, database_name: str, collection_name: str):
         # Get server's address
@@ -28,6 +33,10 @@ class Database:
         # Select database and collection
         self._select_database(database_name)
         self._select_collection(collection_name)
+        self._cards: pymongo.collection.Collection = self._db.get_collection(f'{collection_name}{self.cards_suffix}')
+        # Source documents whose card couldn't be built, mapped to their state at the time.
+        # They are only retried once they change.
+        self._failed_cards = {}
 
         self._preprocess()
 
@@ -37,8 +46,107 @@ class Database:
         """
         self.cache = Cache(self._db, self._collection)
 
-        for info in self._collection.find():
-            self.cache.store_category(info)
+        self._collection.create_index([('fields.id', pymongo.ASCENDING)])
+        self._cards.create_index([('date_start', pymongo.ASCENDING)])
+        self._cards.create_index([('category', pymongo.ASCENDING), ('date_start', pymongo.ASCENDING)])
+        self.refresh_cards()
+        # The cache is emptied on startup, while the cards are kept.
+        self._store_categories()
+
+        threading.Thread(target=self._refresh_cards_periodically, daemon=True).start()
+
+    def _refresh_cards_periodically(self) -> None:
+        """
+        Refreshes the cards every `cards_refresh_interval` seconds.
+        Runs in a background thread, so that pages never wait for a refresh.
+        """
+        while True:
+            sleep(self.cards_refresh_interval)
+            try:
+                self.refresh_cards()
+            except Exception as e:
+                logging.error(f"Couldn't refresh the cards, serving the previous ones: {e!r}")
+
+    def refresh_cards(self) -> None:
+        """
+        Incrementally rebuilds the cards collection from the source documents.
+        Only the documents which are new, whose `updated_at` changed since the last refresh,
+        or whose card was built with a previous `card_version` are read entirely,
+        and the cards of the documents which disappeared are removed.
+        """
+        known_cards = {
+            info['_id']: (info.get('updated_at'), info.get('version'))
+            for info in self._cards.find({}, {'updated_at': 1, 'version': 1})
+        }
+        source_documents = {}
+        for info in self._collection.find({}, {'fields.id': 1, 'fields.updated_at': 1}):
+            fields = info.get('fields', {})
+            if 'id' not in fields:
+                logging.warning(f"Document {info['_id']!r} has no 'fields.id', it won't have a card")
+                continue
+            # Defaults to an empty string, like `validate_fields` does when building the cards.
+            source_documents[fields['id']] = (fields.get('updated_at', ''), card_version)
+
+        # Forget the failures of documents which were deleted since.
+        self._failed_cards = {identifier: state for identifier, state in self._failed_cards.items()
+                              if identifier in source_documents}
+
+        outdated = [identifier for identifier, state in source_documents.items()
+                    if known_cards.get(identifier) != state and self._failed_cards.get(identifier) != state]
+        removed = list(known_cards.keys() - source_documents.keys())
+
+        operations = []
+        for info in self._collection.find({'fields.id': {'$in': outdated}}, {'fields': 1}):
+            identifier = info['fields']['id']
+            try:
+                card = forge_card(Event(info['fields']))
+            except Exception as e:
+                # Skip this document, so that it doesn't prevent the other cards from being built.
+                logging.error(f"Couldn't build the card of event {identifier!r}: {e!r}")
+                self._failed_cards[identifier] = source_documents[identifier]
+                if identifier in known_cards:
+                    # Don't keep serving the card of the previous version of the document.
+                    removed.append(identifier)
+                continue
+            self._failed_cards.pop(identifier, None)
+            operations.append(pymongo.ReplaceOne({'_id': card['_id']}, card, upsert=True))
+
+        if operations:
+            self._cards.bulk_write(operations, ordered=False)
+            # New or updated documents might bring new categories.
+            self._store_categories()
+        if removed:
+            self._cards.delete_many({'_id': {'$in': removed}})
+
+        logging.info(f'Refreshed cards: {len(operations)} updated, {len(removed)} removed')
+
+    def _store_categories(self) -> None:
+        """
+        Stores in the cache the categories found in the cards.
+        """
+        pipeline = [
+            {'$match': {'main_category': {'$ne': ''}}},
+            {'$group': {'_id': {'main_category': '$main_category', 'sub_category': '$sub_category'}}},
+            {'$sort': {'_id.main_category': pymongo.ASCENDING, '_id.sub_category': pymongo.ASCENDING}},
+        ]
+        for info in self._cards.aggregate(pipeline):
+            self.cache.add_category(info['_id']['main_category'], info['_id']['sub_category'])
+
+    def _find_future_cards(self, additional_filter: dict = None) -> pymongo.cursor.Cursor:
+        current_time = int(time())
+        if not additional_filter:
+            additional_filter = {}
+        additional_filter.update({'date_start': {'$gt': current_time}})
+        return self._cards.find(additional_filter, self.card_projection)
+
+    def _get_cards_by_ids(self, identifiers: List[str]) -> List[Card]:
+        """
+        :param List[str] identifiers: Unique IDs of the events.
+        :return List[Card]: The cards of these events, in the same order as the identifiers.
+        """
+        cards = {info['id']: Card(info)
+                 for info in self._cards.find({'_id': {'$in': identifiers}}, self.card_projection)}
+        return [cards[identifier] for identifier in identifiers if identifier in cards]
 
     def _select_database(self, db_name: str) -> None:
         """
@@ -79,34 +187,46 @@ class Database:
     def get_future_events_by_category(self, category: str) -> List[Event]:
         return self.get_future_events({'fields.category': category})
 
-    def get_coming_events_by_category(self, num: int, category: str) -> List[Event]:
+    def get_coming_events_by_category(self, num: int, category: str) -> List[Card]:
         """
         Queries the database to get the nearest incoming `num` events in the category specified.
 
         :param int num: How many events we want to list.
         :param str category: The category to search in. e.g: "Concerts -> Jazz"
-        :return List[Event]: A list containing the Events, ordered from the closest to the most distant (in time).
+        :return List[Card]: A list containing the Cards, ordered from the closest to the most distant (in time).
         """
-        future_events = self.get_future_events_by_category(category)
-        future_events.sort(key=lambda x: x.date_start, reverse=False)
-        return future_events[:num]
+        future_cards = self._find_future_cards({'category': category})
+        future_cards = future_cards.sort('date_start', pymongo.ASCENDING).limit(num)
+        return [Card(info) for info in future_cards]
 
-    def get_random_coming_events_by_category(self, num: int, category: str, random_state: int) -> List[Event]:
+    def get_random_coming_events_by_category(self, num: int, category: str, random_state: int) -> List[Card]:
         random.seed(random_state)
-        future_events = self.get_future_events_by_category(category)
-        random.shuffle(future_events)
-        return future_events[:num]
+        future_cards = [Card(info) for info in self._find_future_cards({'category': category})]
+        random.shuffle(future_cards)
+        return future_cards[:num]
 
-    def get_coming_events(self, num: int) -> List[Event]:
+    def get_coming_events(self, num: int) -> List[Card]:
         """
         Queries the database to get the nearest incoming `num` events.
 
         :param int num: How many events we want to list.
-        :return List[Event]: A list containing the Events, ordered from the closest to the most distant (in time).
+        :return List[Card]: A list containing the Cards, ordered from the closest to the most distant (in time).
         """
-        future_events = self.get_future_events()
-        future_events.sort(key=lambda x: x.date_start, reverse=False)
-        return future_events[:num]
+        future_cards = self._find_future_cards().sort('date_start', pymongo.ASCENDING).limit(num)
+        return [Card(info) for info in future_cards]
+
+    def get_upcoming_event(self) -> Event or None:
+        """
+        Queries the database to get the nearest incoming event, with all its information.
+        Cards whose source document was deleted since the last refresh are skipped.
+
+        :return Event: The nearest incoming event, None if there is none.
+        """
+        for card in self._find_future_cards().sort('date_start', pymongo.ASCENDING):
+            info = self._collection.find_one({'fields.id': card['id']}, {'fields': 1})
+            if info is not None:
+                return Event(info['fields'])
+        return None
 
     def get_unique_event_by_id(self, identifier: int) -> Event:
         return Event(self._collection.find_one({'fields.id': str(identifier)})['fields'])
@@ -136,17 +256,17 @@ class Database:
         f = Filter(**filter_args)
         return f
 
-    def search(self, f: Filter, limit: int = 0) -> List[Event]:
+    def search(self, f: Filter, limit: int = 0) -> List[Card]:
         """
         Searches the database using a filter.
 
         :param Filter f: The Filter instance to use.
         :param int limit: The maximum number of items we want to return.
-        :return list: List of events if some were found, empty otherwise.
+        :return list: List of cards if some events were found, empty otherwise.
         """
         query = f.forge_query()
-        returned_events = self._collection.find(query).limit(limit)
-        return [Event(info['fields']) for info in returned_events]
+        returned_events = self._collection.find(query, {'fields.id': 1}).limit(limit)
+        return self._get_cards_by_ids([info['fields']['id'] for info in returned_events])
 
     def get_occurrences(self, identifier: str) -> Set[int]:
         """
@@ -170,6 +290,8 @@ class Cache:
         self._collection = collection
 
         self.categories_db = self._get_db('cats')
+        # The cards are refreshed in a background thread, which also stores the categories.
+        self._categories_lock = threading.Lock()
 
     def create_cache_dir(self) -> None:
         """
@@ -203,30 +325,22 @@ class Cache:
     # CATEGORIES SECTION #
     ######################
 
-    def store_category(self, info) -> None:
+    def add_category(self, main_category: str, sub_category: str) -> None:
         """
-        Checks if the category of the event is already known, if it is not, store it.
+        Stores the sub-category under its main category, if it is not already known.
         """
-        # *Technically* it would be smarter to create an event with each info,
-        # but it's not the most optimized way of doing it.
-        # Here, we will assume `category` is never missing.
-        # If by any mean it is missing, it will raise a KeyError.
-        category = info['fields']['category']
-        main_category, sub_category = category.split('>')
-        main_category = main_category.strip('-').strip(' ')
-        sub_category = sub_category.strip(' ')
-
-        if main_category in self.categories_db.keys():
-            if sub_category not in self.categories_db[main_category]:
-                sub_categories = self.categories_db[main_category]
-                sub_categories.append(sub_category)
-                self.categories_db[main_category] = sub_categories
+        with self._categories_lock:
+            if main_category in self.categories_db.keys():
+                if sub_category not in self.categories_db[main_category]:
+                    sub_categories = self.categories_db[main_category]
+                    sub_categories.append(sub_category)
+                    self.categories_db[main_category] = sub_categories
+                else:
+                    return
             else:
-                return
-        else:
-            self.categories_db[main_category] = [sub_category]
+                self.categories_db[main_category] = [sub_category]
 
-        self.categories_db.sync()
+            self.categories_db.sync()
 
     def get_all_categories(self) -> dict:
         """
@@ -234,4 +348,5 @@ class Cache:
 
         :return dict: A dictionary containing for each key a main category, and as the value a list of sub-categories.
         """
-        return {k: v for k, v in self.categories_db.items()}
+        with self._categories_lock:
+            return {k: v for k, v in self.categories_db.items()}
@@ -1,5 +1,7 @@
 import json
 
+from typing import Tuple
+
 
 def encode_json(dictionary: dict) -> str:
     """
@@ -19,3 +21,16 @@ def decode_json(json_string: str) -> dict:
     :return dict: An unverified dictionary. Do not trust this data.
     """
     return json.JSONDecoder().decode(json_string)
+
+
+def split_category(category: str) -> Tuple[str, str]:
+    """
+    Takes a category as stored in the dataset and splits it into its main and sub-category.
+
+    :param str category: A category, e.g: "Concerts -> Jazz"
+    :return Tuple[str, str]: The main category and the sub-category, e.g: ("Concerts", "Jazz")
+    """
+    main_category, sub_category = category.split('>')
+    main_category = main_category.strip('-').strip(' ')
+    sub_category = sub_category.strip(' ')
+    return main_category, sub_category